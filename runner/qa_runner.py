@@ -1,51 +1,171 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import collections
+import hashlib
+import itertools
 import json
 import os
 import sys
+import tempfile
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
 
-import requests
+import httpx
+import msgspec
+import orjson
 import yaml
 
+# Prefer the libyaml C binding when PyYAML was built with it.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Parsed configs are cached as JSON keyed by a hash of the YAML bytes.
+YAML_CACHE_DIR = os.environ.get(
+    "QA_YAML_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "qa_runner")
+)
+YAML_CACHE_MAX_AGE_SECONDS = 7 * 24 * 3600
+YAML_HEADER_BYTES = 4096
+# In-flight tests are capped at the client's connection pool size so that
+# measured latency never includes waiting for a free connection.
+MAX_CONCURRENT_TESTS = 32
+# Tests started ahead of the one being reported; bounds results held in memory.
+TEST_WINDOW = 2 * MAX_CONCURRENT_TESTS
+
+# Directories already created by this process.
+_MKDIRS: Set[str] = set()
+
+
+def _ensure_dir(path: str) -> None:
+    if path not in _MKDIRS:
+        os.makedirs(path, exist_ok=True)
+        _MKDIRS.add(path)
+
+
+def _purge_yaml_cache(cache_dir: str) -> None:
+    # Also sweeps .tmp files left behind by a crash before os.replace.
+    cutoff = time.time() - YAML_CACHE_MAX_AGE_SECONDS
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith((".json", ".tmp")):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            # Another runner purged it first.
+            pass
+
+
+def _write_yaml_cache(cache_path: str, data: Any) -> None:
+    text = json.dumps(data)
+    # Only cache configs that survive a JSON round trip unchanged
+    # (e.g. no dates or non-string keys).
+    if json.loads(text) != data:
+        return
+    cache_dir = os.path.dirname(cache_path)
+    _ensure_dir(cache_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    _purge_yaml_cache(cache_dir)
+
+
+def load_yaml_header(path: str) -> Tuple[Any, bool]:
+    """
+    Parse only the first YAML_HEADER_BYTES of a large file.
+    Returns (data, complete): small files, and heads that are inconclusive
+    (no newline, unparseable, or only comments), are loaded in full and
+    reported as complete so callers can reuse the result instead of loading
+    the file again.
+    """
+    with open(path, "rb") as f:
+        head = f.read(YAML_HEADER_BYTES + 1)
+    if len(head) > YAML_HEADER_BYTES:
+        # Cut at the last newline so no scalar (or UTF-8 sequence) is split.
+        head = head[: head.rfind(b"\n", 0, YAML_HEADER_BYTES) + 1]
+        if head:
+            try:
+                header = yaml.load(head.decode("utf-8"), Loader=YAML_LOADER)
+            except (yaml.YAMLError, UnicodeDecodeError):
+                header = None
+            if header is not None:
+                return header, False
+    return load_yaml(path), True
+
 
 def load_yaml(path: str) -> Dict[str, Any]:
-    with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    key = hashlib.blake2b(raw).hexdigest()
+    cache_path = os.path.join(YAML_CACHE_DIR, f"{key}.json")
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    data = yaml.load(raw.decode("utf-8"), Loader=YAML_LOADER)
+    try:
+        _write_yaml_cache(cache_path, data)
+    except (OSError, TypeError, ValueError) as exc:
+        # The cache is best-effort; a read-only home must not fail the run.
+        log(f"Could not cache parsed YAML for {path}: {exc}")
+    return data
 
 
 def now_ms() -> int:
     return int(time.time() * 1000)
 
 
-def log(msg: str) -> None:
-    ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    print(f"[{ts}] {msg}", flush=True)
+_LOG_TS_SECOND = -1
+_LOG_TS = ""
 
 
-def run_http_test(base_url: str, test: Dict[str, Any]) -> Dict[str, Any]:
+def log(msg: str) -> None:
+    global _LOG_TS_SECOND, _LOG_TS
+    # The timestamp only changes once a second, so format it at most that often.
+    second = int(time.time())
+    if second != _LOG_TS_SECOND:
+        _LOG_TS = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        _LOG_TS_SECOND = second
+    print(f"[{_LOG_TS}] {msg}", flush=True)
+
+
+class TestResult(msgspec.Struct):
+    """Outcome of a single test-matrix entry, as written to the report."""
+
+    name: str
+    path: str
+    status: str
+    http_status: Optional[int] = None
+    latency_ms: Optional[int] = None
+    error: Optional[str] = None
+
+
+async def run_http_test(
+    client: httpx.AsyncClient,
+    test: Dict[str, Any],
+    limiter: asyncio.Semaphore,
+) -> TestResult:
     name = test.get("name", "unnamed")
     path = test.get("path", "/")
     method = test.get("method", "GET").upper()
     expect_status = test.get("expect_status", 200)
     max_latency_ms = test.get("max_latency_ms")
 
-    url = base_url.rstrip("/") + path
-
-    start = now_ms()
-    try:
-        resp = requests.request(method, url, timeout=5.0)
-        latency_ms = now_ms() - start
-    except Exception as exc:
-        return {
-            "name": name,
-            "path": path,
-            "status": "io_error",
-            "error": str(exc),
-            "latency_ms": None,
-            "http_status": None,
-        }
+    async with limiter:
+        # Start timing only once a slot is held, so queueing is not counted.
+        start = now_ms()
+        try:
+            resp = await client.request(method, path)
+            latency_ms = now_ms() - start
+        except Exception as exc:
+            return TestResult(name=name, path=path, status="io_error", error=str(exc))
 
     status_ok = resp.status_code == expect_status
     latency_ok = True
@@ -57,76 +177,116 @@ def run_http_test(base_url: str, test: Dict[str, Any]) -> Dict[str, Any]:
     else:
         status_flag = "fail"
 
-    return {
-        "name": name,
-        "path": path,
-        "status": status_flag,
-        "http_status": resp.status_code,
-        "latency_ms": latency_ms,
-    }
+    return TestResult(
+        name=name,
+        path=path,
+        status=status_flag,
+        http_status=resp.status_code,
+        latency_ms=latency_ms,
+    )
 
 
-def update_last_good(state_file: str, module_name: str, image_tag: str) -> None:
-    data: Dict[str, Any] = {}
-    if os.path.exists(state_file):
-        with open(state_file, "r", encoding="utf-8") as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                data = {}
+class LastGoodState:
+    """In-memory view of last_good.json, loaded once and written by save()."""
 
-    modules = data.get("modules", {})
-    modules[module_name] = {
+    def __init__(self, state_file: str) -> None:
+        self.state_file = state_file
+        self.data: Dict[str, Any] = {}
+        try:
+            with open(state_file, "rb") as f:
+                self.data = orjson.loads(f.read())
+        except FileNotFoundError:
+            pass
+        except orjson.JSONDecodeError:
+            self.data = {}
+        self.modules: Dict[str, Any] = self.data.setdefault("modules", {})
+
+    def save(self) -> None:
+        # Write to a temp file and rename so a crash never leaves a torn file.
+        _ensure_dir(os.path.dirname(self.state_file))
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(self.data, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, self.state_file)
+
+
+def update_last_good(state: LastGoodState, module_name: str, image_tag: str) -> None:
+    state.modules[module_name] = {
         "image_tag": image_tag,
         "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
     }
-    data["modules"] = modules
-
-    os.makedirs(os.path.dirname(state_file), exist_ok=True)
-    with open(state_file, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
 
 
-def write_report(
-    reports_dir: str,
-    module_name: str,
-    results: List[Dict[str, Any]],
-    health_ok: bool,
-    health_error: Optional[str],
-) -> str:
-    ts = time.strftime("%Y%m%d-%H%M%S", time.localtime())
-    module_dir = os.path.join(reports_dir, module_name)
-    os.makedirs(module_dir, exist_ok=True)
-    path = os.path.join(module_dir, f"qa_run_{ts}.json")
-    payload: Dict[str, Any] = {
-        "module": module_name,
-        "health_ok": health_ok,
-        "health_error": health_error,
-        "results": results,
-    }
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, indent=2)
-    return path
-
+class ReportWriter:
+    """
+    Streams a QA report to disk: the header is written on open and each
+    result is appended as it completes, so the file can be tailed live.
+    """
 
-def wait_for_healthy(
-    base_url: str,
+    def __init__(
+        self,
+        reports_dir: str,
+        module_name: str,
+        health_ok: bool,
+        health_error: Optional[str],
+    ) -> None:
+        ts = time.strftime("%Y%m%d-%H%M%S", time.localtime())
+        module_dir = os.path.join(reports_dir, module_name)
+        _ensure_dir(module_dir)
+        self.path = os.path.join(module_dir, f"qa_run_{ts}.json")
+        self.count = 0
+        header = msgspec.json.format(
+            msgspec.json.encode(
+                {
+                    "module": module_name,
+                    "health_ok": health_ok,
+                    "health_error": health_error,
+                }
+            ),
+            indent=2,
+        )
+        self._f = open(self.path, "wb")
+        # Reopen the formatted object to append the streamed results array.
+        self._f.write(header[: header.rindex(b"\n}")] + b',\n  "results": [')
+
+    def add(self, result: TestResult) -> None:
+        self._f.write((b",\n    " if self.count else b"\n    ") + msgspec.json.encode(result))
+        self._f.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        self._f.write(b"\n  ]\n}")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+
+
+async def wait_for_healthy(
+    client: httpx.AsyncClient,
     health_endpoint: str,
     timeout_seconds: int,
     interval_seconds: int,
 ) -> (bool, Optional[str]):
-    url = base_url.rstrip("/") + health_endpoint
+    url = str(client.base_url).rstrip("/") + health_endpoint
     log(
         f"Waiting for health endpoint {url} "
         f"(timeout={timeout_seconds}s, interval={interval_seconds}s)..."
     )
 
-    deadline = time.time() + timeout_seconds
+    # Probes reuse the runner's long-lived client, so retries ride the same
+    # pooled connection instead of reconnecting each time.
+    deadline = time.monotonic() + timeout_seconds
     last_error: Optional[str] = None
+    # Back off exponentially from a short first delay so a fast-starting
+    # service is detected quickly; cap at the configured interval.
+    max_delay = max(interval_seconds, 1)
+    delay = 0.05
 
-    while time.time() < deadline:
+    while (remaining := deadline - time.monotonic()) > 0:
         try:
-            resp = requests.get(url, timeout=3.0)
+            resp = await client.get(health_endpoint, timeout=min(3.0, remaining))
             if resp.status_code == 200:
                 log("Healthcheck OK.")
                 return True, None
@@ -134,7 +294,8 @@ def wait_for_healthy(
         except Exception as exc:
             last_error = str(exc)
         log(f"Healthcheck not ready yet: {last_error}")
-        time.sleep(max(interval_seconds, 1))
+        await asyncio.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        delay = min(max_delay, delay * 1.5)
 
     log("Healthcheck did not become ready before timeout.")
     return False, last_error
@@ -164,7 +325,7 @@ def classify_exit_code(
     return 0
 
 
-def main() -> int:
+async def _amain() -> int:
     parser = argparse.ArgumentParser(description="Generic QA Runner")
     parser.add_argument("--module-name", required=True)
     parser.add_argument("--serviceintent", required=True)
@@ -179,23 +340,29 @@ def main() -> int:
 
     try:
         serviceintent = load_yaml(args.serviceintent)
-        test_matrix = load_yaml(args.test_matrix)
+        # Reject a matrix of the wrong shape before parsing all of it.
+        test_matrix, complete = load_yaml_header(args.test_matrix)
+        if not isinstance(test_matrix, dict):
+            raise ValueError(f"{args.test_matrix}: test matrix must be a mapping")
+        if not complete:
+            test_matrix = load_yaml(args.test_matrix)
     except Exception as exc:
         log(f"Failed to load config YAML: {exc}")
         config_error = True
         # We still proceed to write a minimal report below.
 
         base_url = "http://invalid"
+        target_cfg: Dict[str, Any] = {}
         image_tag = "unknown"
         tests: List[Dict[str, Any]] = []
     else:
-        target_cfg = serviceintent.get("target", {})
+        target_cfg = serviceintent.get("target") or {}
         base_url = target_cfg.get("base_url")
         if not base_url:
             log("Missing target.base_url in serviceintent.")
             config_error = True
 
-        deployment_cfg = serviceintent.get("deployment", {})
+        deployment_cfg = serviceintent.get("deployment") or {}
         base_image = deployment_cfg.get("base_image", "unknown")
 
         qa_tag = os.environ.get("QA_TAG")
@@ -211,42 +378,71 @@ def main() -> int:
 
     health_ok = True
     health_error: Optional[str] = None
-    results: List[Dict[str, Any]] = []
+    report: Optional[ReportWriter] = None
+    tests_run = 0
     test_errors = 0
     io_errors = 0
 
     if not config_error:
-        health_endpoint = (
-            serviceintent.get("target", {}).get("health_endpoint", "/health")
-        )
-        timeout_seconds = int(
-            serviceintent.get("target", {}).get("health_timeout_seconds", 60)
-        )
-        interval_seconds = int(
-            serviceintent.get("target", {}).get("health_check_interval_seconds", 2)
-        )
-
-        health_ok, health_error = wait_for_healthy(
-            base_url, health_endpoint, timeout_seconds, interval_seconds
-        )
-
-        if not health_ok:
-            # Health never became OK -> we do not run tests, but still report.
-            log("Healthcheck failed to reach OK state; skipping tests.")
-        else:
-            log(
-                f"Starting QA for module={module_name} "
-                f"base_url={base_url} tests={len(tests)}"
+        health_endpoint = target_cfg.get("health_endpoint", "/health")
+        timeout_seconds = int(target_cfg.get("health_timeout_seconds", 60))
+        interval_seconds = int(target_cfg.get("health_check_interval_seconds", 2))
+
+        # http2=True lets HTTPS targets (e.g. via Traefik) multiplex all tests
+        # over one connection; plain http:// targets stay on HTTP/1.1.
+        async with httpx.AsyncClient(
+            base_url=base_url,
+            http2=True,
+            timeout=5.0,
+            limits=httpx.Limits(max_connections=MAX_CONCURRENT_TESTS),
+        ) as client:
+            health_ok, health_error = await wait_for_healthy(
+                client, health_endpoint, timeout_seconds, interval_seconds
             )
-            for test in tests:
-                r = run_http_test(base_url, test)
-                results.append(r)
-                status_flag = r.get("status")
-                if status_flag == "io_error":
-                    io_errors += 1
-                elif status_flag != "pass":
-                    test_errors += 1
-                log(f"Test {r['name']}: {status_flag}")
+
+            if not health_ok:
+                # Health never became OK -> we do not run tests, but still report.
+                log("Healthcheck failed to reach OK state; skipping tests.")
+            else:
+                log(
+                    f"Starting QA for module={module_name} "
+                    f"base_url={base_url} tests={len(tests)}"
+                )
+                if not args.dry_run:
+                    report = ReportWriter(
+                        args.reports_dir, module_name, health_ok, health_error
+                    )
+                # Tests start through a bounded window and are awaited in matrix
+                # order, so the log and report stay ordered while results stream out.
+                limiter = asyncio.Semaphore(MAX_CONCURRENT_TESTS)
+                window: Deque["asyncio.Task[TestResult]"] = collections.deque()
+                unstarted = iter(tests)
+                try:
+                    while True:
+                        for t in itertools.islice(unstarted, TEST_WINDOW - len(window)):
+                            window.append(
+                                asyncio.create_task(run_http_test(client, t, limiter))
+                            )
+                        if not window:
+                            break
+                        r = await window.popleft()
+                        tests_run += 1
+                        if report is not None:
+                            report.add(r)
+                        status_flag = r.status
+                        if status_flag == "io_error":
+                            io_errors += 1
+                        elif status_flag != "pass":
+                            test_errors += 1
+                        log(f"Test {r.name}: {status_flag}")
+                finally:
+                    # On errors or cancellation, stop outstanding tests and still
+                    # leave a valid (partial) report behind.
+                    for task in window:
+                        task.cancel()
+                    await asyncio.gather(*window, return_exceptions=True)
+                    if report is not None:
+                        report.close()
 
     exit_code = classify_exit_code(
         config_error=config_error,
@@ -261,25 +457,33 @@ def main() -> int:
             "config_error": config_error,
             "health_ok": health_ok,
             "health_error": health_error,
-            "tests": len(results),
+            "tests": tests_run,
             "test_errors": test_errors,
             "io_errors": io_errors,
             "exit_code": exit_code,
         }
-        print(json.dumps(summary))
+        sys.stdout.buffer.write(orjson.dumps(summary) + b"\n")
+        sys.stdout.buffer.flush()
 
     if not args.dry_run:
-        report_path = write_report(
-            args.reports_dir, module_name, results, health_ok, health_error
-        )
-        log(f"Report written to {report_path}")
+        if report is None:
+            # No tests ran (config error or health failure); still report.
+            report = ReportWriter(args.reports_dir, module_name, health_ok, health_error)
+        report.close()
+        log(f"Report written to {report.path}")
         if exit_code == 0 and not config_error:
-            update_last_good(args.state_file, module_name, image_tag)
+            state = LastGoodState(args.state_file)
+            update_last_good(state, module_name, image_tag)
+            state.save()
             log("last_good.json updated for module " + module_name)
 
     return exit_code
 
 
+def main() -> int:
+    return asyncio.run(_amain())
+
+
 if __name__ == "__main__":
     sys.exit(main())
 
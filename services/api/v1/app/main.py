@@ -1,6 +1,10 @@
-from fastapi import FastAPI, Response, status
+from fastapi import FastAPI, Request, Response, status
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from functools import lru_cache
+import asyncio
+import gzip
 import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
 
 app = FastAPI(title="Sample API v1")
 
@@ -17,43 +21,98 @@ REQUEST_LATENCY = Histogram(
 )
 
 
+def _accepts_gzip(accept_encoding: str) -> bool:
+    # Honour q-values so "gzip;q=0" opts out; an explicit gzip entry wins over "*".
+    qvalues: Dict[str, float] = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[name.strip().lower()] = q
+    return qvalues.get("gzip", qvalues.get("*", 0.0)) > 0
+
+
+@lru_cache(maxsize=2)
+def _metrics_payload(bucket: int, gzipped: bool) -> bytes:
+    # Keyed on a one-second monotonic bucket so concurrent scrapes share one render.
+    data = generate_latest()  # type: ignore[arg-type]
+    return gzip.compress(data, compresslevel=1) if gzipped else data
+
+
+def _bind_metrics(endpoint: str, method: str, status_code: int) -> Tuple[Any, Any]:
+    return (
+        REQUEST_COUNT.labels(endpoint=endpoint, method=method, status_code=status_code),
+        REQUEST_LATENCY.labels(endpoint=endpoint, method=method),
+    )
+
+
+# Label children for the routes we serve, bound once at import time.
+_METRICS: Dict[Tuple[str, str, int], Tuple[Any, Any]] = {
+    key: _bind_metrics(*key)
+    for key in (
+        ("/health", "GET", status.HTTP_200_OK),
+        ("/slow", "GET", status.HTTP_200_OK),
+        ("/error", "GET", status.HTTP_500_INTERNAL_SERVER_ERROR),
+        ("/metrics", "GET", status.HTTP_200_OK),
+    )
+}
+
+
 def track_request(endpoint: str, method: str, status_code: int, start_time: float) -> None:
-    duration = time.time() - start_time
-    REQUEST_COUNT.labels(endpoint=endpoint, method=method, status_code=status_code).inc()
-    REQUEST_LATENCY.labels(endpoint=endpoint, method=method).observe(duration)
+    duration = time.perf_counter() - start_time
+    children = _METRICS.get((endpoint, method, status_code))
+    if children is None:
+        children = _bind_metrics(endpoint, method, status_code)
+    counter, histogram = children
+    counter.inc()
+    histogram.observe(duration)
+
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Only declared API routes are tracked, and undeclared methods (405s) share one
+    # "other" label, so client-chosen paths or methods cannot add label values.
+    route = request.scope.get("route")
+    if route is not None:
+        method = request.method if request.method in route.methods else "other"
+        track_request(route.path, method, response.status_code, start)
+    return response
 
 
 @app.get("/health")
 def health() -> dict:
-    start = time.time()
-    status_code = status.HTTP_200_OK
-    track_request("/health", "GET", status_code, start)
     return {"status": "ok", "service": "api-v1"}
 
 
 @app.get("/slow")
-def slow(delay_ms: int = 1500) -> dict:
-    start = time.time()
-    time.sleep(max(delay_ms, 0) / 1000.0)
-    status_code = status.HTTP_200_OK
-    track_request("/slow", "GET", status_code, start)
+async def slow(delay_ms: int = 1500) -> dict:
+    await asyncio.sleep(max(delay_ms, 0) / 1000.0)
     return {"status": "ok", "delay_ms": delay_ms}
 
 
 @app.get("/error")
 def error() -> Response:
-    start = time.time()
-    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
-    track_request("/error", "GET", status_code, start)
     return Response(
         content='{"error": "simulated error"}',
-        status_code=status_code,
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         media_type="application/json",
     )
 
 
 @app.get("/metrics")
-def metrics() -> Response:
-    data = generate_latest()  # type: ignore[arg-type]
-    return Response(content=data, media_type=CONTENT_TYPE_LATEST)
+def metrics(request: Request) -> Response:
+    gzipped = _accepts_gzip(request.headers.get("accept-encoding", ""))
+    data = _metrics_payload(int(time.monotonic()), gzipped)
+    headers = {"Vary": "Accept-Encoding"}
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=data, media_type=CONTENT_TYPE_LATEST, headers=headers)
 
@@ -1,7 +1,11 @@
-from fastapi import FastAPI, Response, status
+from fastapi import FastAPI, Request, Response, status
 from fastapi.responses import HTMLResponse
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from functools import lru_cache
+import gzip
+import hashlib
 import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
 
 app = FastAPI(title="Sample UI v1")
 
@@ -18,18 +22,74 @@ REQUEST_LATENCY = Histogram(
 )
 
 
+def _accepts_gzip(accept_encoding: str) -> bool:
+    # Honour q-values so "gzip;q=0" opts out; an explicit gzip entry wins over "*".
+    qvalues: Dict[str, float] = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[name.strip().lower()] = q
+    return qvalues.get("gzip", qvalues.get("*", 0.0)) > 0
+
+
+@lru_cache(maxsize=2)
+def _metrics_payload(bucket: int, gzipped: bool) -> bytes:
+    # Keyed on a one-second monotonic bucket so concurrent scrapes share one render.
+    data = generate_latest()  # type: ignore[arg-type]
+    return gzip.compress(data, compresslevel=1) if gzipped else data
+
+
+def _bind_metrics(endpoint: str, method: str, status_code: int) -> Tuple[Any, Any]:
+    return (
+        REQUEST_COUNT.labels(endpoint=endpoint, method=method, status_code=status_code),
+        REQUEST_LATENCY.labels(endpoint=endpoint, method=method),
+    )
+
+
+# Label children for the routes we serve, bound once at import time.
+_METRICS: Dict[Tuple[str, str, int], Tuple[Any, Any]] = {
+    key: _bind_metrics(*key)
+    for key in (
+        ("/", "GET", status.HTTP_200_OK),
+        ("/", "GET", status.HTTP_304_NOT_MODIFIED),
+        ("/health", "GET", status.HTTP_200_OK),
+        ("/error", "GET", status.HTTP_500_INTERNAL_SERVER_ERROR),
+        ("/metrics", "GET", status.HTTP_200_OK),
+    )
+}
+
+
 def track_request(endpoint: str, method: str, status_code: int, start_time: float) -> None:
-    duration = time.time() - start_time
-    REQUEST_COUNT.labels(endpoint=endpoint, method=method, status_code=status_code).inc()
-    REQUEST_LATENCY.labels(endpoint=endpoint, method=method).observe(duration)
+    duration = time.perf_counter() - start_time
+    children = _METRICS.get((endpoint, method, status_code))
+    if children is None:
+        children = _bind_metrics(endpoint, method, status_code)
+    counter, histogram = children
+    counter.inc()
+    histogram.observe(duration)
 
 
-@app.get("/", response_class=HTMLResponse)
-def index() -> str:
-    start = time.time()
-    status_code = status.HTTP_200_OK
-    track_request("/", "GET", status_code, start)
-    return """
+@app.middleware("http")
+async def track_requests(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Only declared API routes are tracked, and undeclared methods (405s) share one
+    # "other" label, so client-chosen paths or methods cannot add label values.
+    route = request.scope.get("route")
+    if route is not None:
+        method = request.method if request.method in route.methods else "other"
+        track_request(route.path, method, response.status_code, start)
+    return response
+
+
+_INDEX_HTML: bytes = """
 <!doctype html>
 <html>
   <head>
@@ -41,31 +101,41 @@ def index() -> str:
     <p>This is a minimal demo frontend service used for QA pipeline experiments.</p>
   </body>
 </html>
-"""
+""".encode("utf-8")
+
+_INDEX_HEADERS = {
+    "Cache-Control": "public, max-age=3600",
+    "ETag": '"' + hashlib.blake2b(_INDEX_HTML).hexdigest()[:16] + '"',
+}
+
+
+@app.get("/", response_class=HTMLResponse)
+def index(request: Request) -> Response:
+    if request.headers.get("if-none-match") == _INDEX_HEADERS["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_INDEX_HEADERS)
+    return Response(content=_INDEX_HTML, media_type="text/html", headers=_INDEX_HEADERS)
 
 
 @app.get("/health")
 def health() -> dict:
-    start = time.time()
-    status_code = status.HTTP_200_OK
-    track_request("/health", "GET", status_code, start)
     return {"status": "ok", "service": "ui-v1"}
 
 
 @app.get("/error")
 def error() -> Response:
-    start = time.time()
-    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
-    track_request("/error", "GET", status_code, start)
     return Response(
         content='{"error": "simulated ui error"}',
-        status_code=status_code,
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         media_type="application/json",
     )
 
 
 @app.get("/metrics")
-def metrics() -> Response:
-    data = generate_latest()  # type: ignore[arg-type]
-    return Response(content=data, media_type=CONTENT_TYPE_LATEST)
+def metrics(request: Request) -> Response:
+    gzipped = _accepts_gzip(request.headers.get("accept-encoding", ""))
+    data = _metrics_payload(int(time.monotonic()), gzipped)
+    headers = {"Vary": "Accept-Encoding"}
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=data, media_type=CONTENT_TYPE_LATEST, headers=headers)
 